@@ -1,13 +1,15 @@
 import asyncio
+import hashlib
 import os
 import time
 import multiprocessing
 import psutil
+import numpy as np
 import matplotlib.pyplot as plt
 import random
 import logging
 import aiofiles
-from pipeline import AssemblyLine, calculate_checksum, dynamic_concurrency, optimal_fragment_size
+from pipeline import AssemblyLine, NodeSegment, dynamic_concurrency, optimal_fragment_size
 
 # Configure logging for benchmark
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -28,26 +30,34 @@ def log_resource_usage(stage):
 
 
 async def simulate_node_failure(node_paths, failure_rate=0.05):
-    """Randomly delete or corrupt some fragments to simulate node failure."""
-    for node_path in node_paths:
-        files = os.listdir(node_path)
-        for file in files:
+    """Randomly delete or corrupt some stored shares to simulate node failure."""
+    async def corrupt_share(segment_path, key, offset, length):
+        # Flip one byte in place instead of rewriting the whole share
+        if length < 11:
+            return
+        async with aiofiles.open(segment_path, "r+b") as f:
+            await f.seek(offset + 10)
+            byte = (await f.read(1))[0]
+            await f.seek(offset + 10)
+            await f.write(bytes([byte ^ 0xFF]))
+        logging.warning(f"Simulated failure: Corrupted share {key} in {segment_path}")
+
+    async def fail_node(node_path):
+        segment = NodeSegment(node_path)
+        index = segment.load_index()
+        corruptions = []
+        for key, (offset, length) in list(index.items()):
             if random.random() < failure_rate:
-                fragment_path = os.path.join(node_path, file)
                 if random.random() < 0.5:
-                    # Delete the fragment to simulate missing data
-                    os.remove(fragment_path)
-                    logging.warning(f"Simulated failure: Deleted fragment {fragment_path}")
+                    # Drop the share from the node's index to simulate missing data
+                    del index[key]
+                    logging.warning(f"Simulated failure: Deleted share {key} on {node_path}")
                 else:
-                    # Corrupt the fragment by altering its contents
-                    async with aiofiles.open(fragment_path, "rb+") as f:
-                        data = await f.read()
-                        if len(data) >= 10:
-                            corrupted_data = bytearray(data)
-                            corrupted_data[10] ^= 0xFF  # Flip a bit
-                            await f.seek(0)
-                            await f.write(corrupted_data)
-                            logging.warning(f"Simulated failure: Corrupted fragment {fragment_path}")
+                    corruptions.append(corrupt_share(segment.segment_path, key, offset, length))
+        await asyncio.gather(*corruptions)
+        segment.save_index(index)
+
+    await asyncio.gather(*[fail_node(node_path) for node_path in node_paths])
 
 
 async def benchmark():
@@ -64,62 +74,66 @@ async def benchmark():
 
         # Clean up previous fragments
         for node_path in NODE_PATHS:
-            for file in os.listdir(node_path):
-                file_path = os.path.join(node_path, file)
-                os.remove(file_path)
+            with os.scandir(node_path) as entries:
+                for entry in entries:
+                    os.remove(entry.path)
 
         # Determine optimal fragment size
         fragment_size = optimal_fragment_size(data_size)
         print(f"Using Fragment Size: {fragment_size / 1024:.2f} KB")
 
         # Generate random data
-        if data_size > 1024 * 1024 * 500:  # If dataset > 500 MB, generate in chunks
-            data = bytearray()
-            chunk_size = 1024 * 1024  # 1 MB
-            for _ in range(data_size // chunk_size):
-                data += os.urandom(chunk_size)
-            remaining = data_size % chunk_size
-            if remaining:
-                data += os.urandom(remaining)
-            data = bytes(data)
-        else:
-            data = os.urandom(data_size)
-        dataset_checksum = calculate_checksum(data)
-        # Set replication factor based on dataset size
+        # PCG64 output is plenty for benchmark input and far cheaper than os.urandom. Fill a
+        # preallocated buffer 1 MB at a time, hashing each chunk as it is written; generating it
+        # in one rng.bytes call would briefly hold twice the dataset (a uint32 array plus its copy).
+        # Fragments are zero-copy memoryview slices of this buffer.
+        rng = np.random.default_rng()
+        data = bytearray(data_size)
+        view = memoryview(data)
+        hasher = hashlib.sha256()
+        chunk_size = 1024 * 1024  # 1 MB
+        for offset in range(0, data_size, chunk_size):
+            chunk = rng.bytes(min(chunk_size, data_size - offset))
+            view[offset:offset + len(chunk)] = chunk
+            hasher.update(chunk)
+        dataset_checksum = hasher.digest()
+        # Set Reed-Solomon (k, n) shares based on dataset size. A fragment survives losing any
+        # n - k shares; storage and encryption cost is n / k. More, smaller shares buy durability
+        # at the same overhead, at the cost of more shares to encrypt and index per fragment.
+        # Loss probabilities below are per fragment under simulate_node_failure's 5% share loss.
         if data_size > 1024 * 10000:  # > 10 MB
-            replication_factor = 5
+            # 1.5x overhead (was 5x), tolerates 10 lost shares; ~1.1e-7 vs ~3.1e-7 for rf=5
+            data_shares, total_shares = 20, 30
         else:
-            replication_factor = 2
-        assembly_line = AssemblyLine(NODE_PATHS, dataset_checksum, fragment_size, replication_factor=replication_factor)
+            # 1.5x overhead (was 2x), tolerates 6 lost shares; ~1.5e-5 vs 2.5e-3 for rf=2
+            data_shares, total_shares = 12, 18
+        assembly_line = AssemblyLine(NODE_PATHS, dataset_checksum, fragment_size,
+                                     data_shares=data_shares, total_shares=total_shares)
 
         # Determine dynamic concurrency
         max_concurrent_tasks = dynamic_concurrency(data_size, fragment_size)
-        print(f"Using Max Concurrent Tasks: {max_concurrent_tasks}")
+        print(f"Using Initial Concurrency Target: {max_concurrent_tasks}")
 
         start_time = time.time()
 
         # Fragmentation
         print("Starting fragment creation...")
         log_resource_usage("Fragment Creation")
-        fragments = await assembly_line.fragment_data(data, fragment_size)
-        print(f"Fragments created: {len(fragments)}")
+        num_fragments = assembly_line.fragment_count(data_size)
+        fragments = assembly_line.fragment_data(view)
+        print(f"Fragments to create: {num_fragments}")
 
         # Determine if dataset is small and should be processed inline
         inline = False
         if data_size <= 1024 * 100:  # <= 100 KB
             inline = True
 
-        # Encryption
-        print("Starting encryption...")
-        log_resource_usage("Encryption")
-        encrypted_fragments = await assembly_line.encrypt_fragments(fragments, inline=inline)
-        print("Encryption completed.")
-
-        # Batched Storage
-        print("Starting batched storage...")
-        log_resource_usage("Batched Storage")
+        # Encryption and batched storage, streamed one fragment at a time
+        print("Starting encryption and storage...")
+        log_resource_usage("Encryption and Storage")
+        encrypted_fragments = assembly_line.encrypt_fragments(fragments, inline=inline, num_fragments=num_fragments)
         await assembly_line.store_fragments(encrypted_fragments, max_concurrent_tasks=max_concurrent_tasks)
-        print("Storage completed.")
+        print("Encryption and storage completed.")
 
         # Simulate Node Failures for testing (e.g., 5% failure rate)
         if data_size >= 1024 * 1000:  # Only simulate failures for datasets >= 1 MB
@@ -129,7 +143,8 @@ async def benchmark():
         # Retrieval
         print("Starting retrieval...")
         log_resource_usage("Retrieval")
-        retrieved_fragments = await assembly_line.retrieve_fragments(len(fragments), max_concurrent_tasks=max_concurrent_tasks)
+        # Retrieval starts from the concurrency target the store phase learned
+        retrieved_fragments = await assembly_line.retrieve_fragments(num_fragments)
         print(f"Retrieved fragments: {len(retrieved_fragments)}")
 
         # Reassembly
@@ -149,16 +164,16 @@ async def benchmark():
             "Fragment Size (KB)": fragment_size / 1024,
             "Time (s)": round(elapsed_time, 6),
             "Integrity Verified": "Success" if is_verified else "Failure",
-            "Max Concurrent Tasks": max_concurrent_tasks
+            "Initial Concurrency": max_concurrent_tasks
         })
 
     # Summary
     print("\n==== Summary ====")
-    header = f"{'Dataset Size (KB)':<20}{'Fragment Size (KB)':<20}{'Time (s)':<12}{'Integrity Verified':<20}{'Max Concurrency':<20}"
+    header = f"{'Dataset Size (KB)':<20}{'Fragment Size (KB)':<20}{'Time (s)':<12}{'Integrity Verified':<20}{'Initial Concurrency':<20}"
     print(header)
     print("-" * len(header))
     for result in results:
-        print(f"{result['Dataset Size (KB)']:<20}{result['Fragment Size (KB)']:<20}{result['Time (s)']:<12}{result['Integrity Verified']:<20}{result['Max Concurrent Tasks']:<20}")
+        print(f"{result['Dataset Size (KB)']:<20}{result['Fragment Size (KB)']:<20}{result['Time (s)']:<12}{result['Integrity Verified']:<20}{result['Initial Concurrency']:<20}")
 
     # Visualization
     dataset_sizes_kb = [result["Dataset Size (KB)"] for result in results]
@@ -1,13 +1,14 @@
-import time
 import logging
 
+ENCRYPTED_PREFIX = b"ENC:"
+
 class EncryptionManager:
     def encrypt(self, fragment):
         logging.info(f"Encrypting fragment: {fragment[:10]}...")
-        time.sleep(0.1)  # Simulate encryption delay
-        return f"encrypted({fragment.decode()})".encode()
+        return ENCRYPTED_PREFIX + fragment
 
     def decrypt(self, encrypted_fragment):
         logging.info(f"Decrypting fragment: {encrypted_fragment[:10]}...")
-        time.sleep(0.1)  # Simulate decryption delay
-        return encrypted_fragment.replace(b"encrypted(", b"").replace(b")", b"")
+        if not encrypted_fragment.startswith(ENCRYPTED_PREFIX):
+            raise ValueError("Fragment is not in the expected encrypted format.")
+        return encrypted_fragment[len(ENCRYPTED_PREFIX):]
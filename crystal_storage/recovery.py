@@ -1,4 +1,4 @@
-import pickle
+import struct
 import logging
 
 class RecoveryManager:
@@ -10,8 +10,8 @@ class RecoveryManager:
 
     def recover_data(self):
         try:
-            with open('data/fragment_info.pkl', 'rb') as f:
-                num_fragments = pickle.load(f)
+            with open('data/fragment_info.bin', 'rb') as f:
+                num_fragments = struct.unpack('<Q', f.read(8))[0]
             logging.info(f"Number of fragments to recover: {num_fragments}")
             fragments = self.routing_manager.retrieve_fragments(num_fragments, self.encryption_manager)
             compressed_data = self.fragmentation_manager.merge_fragments(fragments)
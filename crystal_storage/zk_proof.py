@@ -1,4 +1,3 @@
-import pickle
 import logging
 
 class ZKProofManager:
@@ -6,13 +5,14 @@ class ZKProofManager:
         import hashlib
         return hashlib.sha256(data).digest()
 
-    def store_data_hash(self, data_hash, path='data/data_hash.pkl'):
+    def store_data_hash(self, data_hash, path='data/data_hash.bin'):
+        # The SHA-256 digest is stored as its 32 raw bytes
         with open(path, 'wb') as f:
-            pickle.dump(data_hash, f)
+            f.write(data_hash)
 
-    def get_stored_data_hash(self, path='data/data_hash.pkl'):
+    def get_stored_data_hash(self, path='data/data_hash.bin'):
         with open(path, 'rb') as f:
-            return pickle.load(f)
+            return f.read(32)
 
     def verify_integrity(self, current_hash):
         stored_hash = self.get_stored_data_hash()
@@ -1,60 +1,139 @@
 import asyncio
+import contextlib
+import functools
 import os
 import logging
-import hashlib
+import math
 import multiprocessing
+import pickle
+import struct
+import time
+from hashlib import sha256 as _sha256
 from concurrent.futures import ProcessPoolExecutor
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from multiprocessing.shared_memory import SharedMemory
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
-import aiofiles
-import zlib
+import zfec
+import zstandard as zstd
 import random
 
 # Configure logging
 LOG_LEVEL = logging.INFO  # Set to logging.DEBUG for detailed logs
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Compression payloads carry a 1-byte tag: zstd frame, or raw bytes when compression doesn't pay
+_RAW_TAG = b"\x00"
+_ZSTD_TAG = b"\x01"
+_COMPRESSOR = zstd.ZstdCompressor(level=1)
+_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+# Hard caps and update period for the adaptive store/retrieve concurrency controller
+MIN_CONCURRENT_TASKS = 5
+MAX_CONCURRENT_TASKS = 512
+CONCURRENCY_UPDATE_INTERVAL = 0.5  # seconds
+
+# Upper bound on fragments handed to a worker process per executor task
+FRAGMENTS_PER_TASK = 16
+
+
+# Each share's key material is a 32-byte AES key followed by a 12-byte GCM nonce
+KEY_RECORD_SIZE = 44
+_CHACHA20_BLOCK_SIZE = 64
+
+
+def derive_key_material(master_key, first_record, num_records):
+    """Derive (key, nonce) pairs for a run of shares in a single ChaCha20 keystream call."""
+    # Record i = fragment_id * total_shares + share_id is keystream bytes [i * 44, (i + 1) * 44)
+    start = first_record * KEY_RECORD_SIZE
+    block, skip = divmod(start, _CHACHA20_BLOCK_SIZE)
+    # 16-byte ChaCha20 nonce: 4-byte little-endian block counter + 12-byte zero nonce
+    encryptor = Cipher(algorithms.ChaCha20(master_key, struct.pack("<I", block) + bytes(12)), mode=None).encryptor()
+    stream = encryptor.update(bytes(skip + num_records * KEY_RECORD_SIZE))
+    return [
+        (stream[offset:offset + 32], stream[offset + 32:offset + KEY_RECORD_SIZE])
+        for offset in range(skip, len(stream), KEY_RECORD_SIZE)
+    ]
+
 
 class KeyManagementSystem:
     """Deterministic Key Management System using dataset checksum."""
-    def __init__(self, dataset_checksum):
+    def __init__(self, dataset_checksum, total_shares=1):
         self.dataset_checksum = dataset_checksum
-
-    def generate_key(self, fragment_id, replica=0):
-        """Generate deterministic key and nonce for a fragment and its replica."""
-        # Include replica index to generate different keys for replicas
-        seed = f"{fragment_id}:{self.dataset_checksum}:{replica}".encode()
+        self.total_shares = total_shares
+        # Stretch the checksum once; per-share keys are cheap keystream slices derived from this
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
-            salt=seed[:16],
-            iterations=100000,
-            backend=default_backend()
+            salt=dataset_checksum[:16],
+            iterations=100000
         )
-        key = kdf.derive(seed)
-        nonce = seed[:12]  # GCM requires a 12-byte nonce
-        return key, nonce
+        self.master_key = kdf.derive(dataset_checksum)
+
+    def generate_fragment_keys(self, fragment_id):
+        """Generate the (key, nonce) pairs for every share of a fragment in one call."""
+        return derive_key_material(self.master_key, fragment_id * self.total_shares, self.total_shares)
 
 
 def calculate_checksum(data):
     """Calculate a SHA-256 checksum."""
-    return hashlib.sha256(data).digest()
+    # Single OpenSSL call over any bytes-like object (bytes, bytearray, memoryview) without copying
+    return _sha256(data).digest()
 
 
 def dynamic_concurrency(dataset_size, fragment_size):
-    """Determine max concurrent tasks based on dataset size and fragment size."""
+    """Determine the initial concurrency target; AdaptiveConcurrency tunes it from there."""
     cpu_count = multiprocessing.cpu_count()
-    base_concurrency = min(50, cpu_count * 2)  # Base level concurrency
-
-    # Scale with dataset size
-    if dataset_size <= 1024 * 100:  # Small datasets (<= 100 KB)
-        return max(5, base_concurrency // 4)  # Further reduce concurrency for very small datasets
-    elif dataset_size <= 1024 * 10000:  # Medium datasets (<= 10 MB)
-        return base_concurrency
-    else:  # Large datasets (> 10 MB)
-        return min(300, base_concurrency * 3)  # Maximize concurrency for large datasets
+    # No point starting above the number of fragments there are to work on
+    num_fragments = -(-dataset_size // max(1, fragment_size))
+    return max(MIN_CONCURRENT_TASKS, min(MAX_CONCURRENT_TASKS, cpu_count * 2, num_fragments))
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit that grows while task latency stays flat and shrinks when p99 latency rises."""
+    def __init__(self, limit, min_tasks=MIN_CONCURRENT_TASKS, max_tasks=MAX_CONCURRENT_TASKS):
+        self.min_tasks = min_tasks
+        self.max_tasks = max_tasks
+        self.limit = max(min_tasks, min(max_tasks, limit))
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._latencies = []
+        self._window_start = time.monotonic()
+        self._mean = None
+        self._p99 = None
+
+    async def acquire(self):
+        """Wait for a free slot under the current limit; returns the task start time."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started):
+        """Free a slot, recording the latency of the task that started at started."""
+        now = time.monotonic()
+        self._latencies.append(now - started)
+        if now - self._window_start >= CONCURRENCY_UPDATE_INTERVAL:
+            self._update(now)
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify(self.limit - self._in_flight)
+
+    def _update(self, now):
+        latencies = sorted(self._latencies)
+        mean = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        if self._mean is not None:
+            if p99 > 1.5 * self._p99:
+                self.limit = max(self.min_tasks, self.limit * 3 // 4)
+            elif mean <= 1.1 * self._mean:
+                self.limit = min(self.max_tasks, self.limit + max(1, self.limit // 8))
+        logging.debug(f"Concurrency limit {self.limit} (mean {mean * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms).")
+        self._mean, self._p99 = mean, p99
+        self._latencies = []
+        self._window_start = now
 
 
 def optimal_fragment_size(dataset_size):
@@ -66,199 +145,398 @@ def optimal_fragment_size(dataset_size):
     elif dataset_size <= 1024 * 10000:  # <= 10 MB
         return 1024 * 100  # 100 KB
     else:  # > 10 MB
-        return 1024 * 200  # 200 KB
+        # Linear compress -> erasure-code -> encrypt passes stop gaining past 64-128 KB chunks
+        return 1024 * 96  # 96 KB
 
 
-def encrypt_fragment_sync(args):
-    """Synchronous encryption function for ProcessPoolExecutor."""
-    fragment_id, fragment, dataset_checksum, replica = args
-    kms = KeyManagementSystem(dataset_checksum)
-    key, nonce = kms.generate_key(fragment_id, replica)
-    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
-    encryptor = cipher.encryptor()
-    encrypted_fragment = encryptor.update(fragment) + encryptor.finalize()
-    tag = encryptor.tag
-    checksum = calculate_checksum(encrypted_fragment)
-    # Removed logging to prevent pickling issues
-    return (fragment_id, replica, encrypted_fragment, tag, checksum)
+@functools.lru_cache(maxsize=None)
+def _zfec_encoder(data_shares, total_shares):
+    """Per-process cache of Reed-Solomon encoders."""
+    return zfec.Encoder(data_shares, total_shares)
 
 
-def compress_data(data):
-    """Compress data using zlib."""
-    return zlib.compress(data)
+def encrypt_fragment_sync(args):
+    """Synchronous compress, erasure-code and encrypt function for ProcessPoolExecutor."""
+    fragment_id, fragment, master_key, data_shares, total_shares = args
+    shares = encode_shares(_zfec_encoder(data_shares, total_shares), compress_parts(fragment), data_shares)
+    fragment_keys = derive_key_material(master_key, fragment_id * total_shares, total_shares)
+    encrypted_shares = []
+    for share_id, (share, (key, nonce)) in enumerate(zip(shares, fragment_keys)):
+        # One-shot AEAD call; the output is ciphertext + 16-byte GCM tag, stored as-is
+        encrypted_shares.append((fragment_id, share_id, AESGCM(key).encrypt(nonce, share, None)))
+    # Removed logging to prevent pickling issues
+    return encrypted_shares
+
+
+def encrypt_fragment_batch_sync(args):
+    """Encrypt a batch of (fragment_id, offset, length) fragments read from shared memory, for ProcessPoolExecutor."""
+    shm_name, batch, master_key, data_shares, total_shares = args
+    shm = SharedMemory(name=shm_name)
+    try:
+        encrypted_shares = []
+        for fragment_id, offset, length in batch:
+            with shm.buf[offset:offset + length] as fragment:
+                encrypted_shares.extend(
+                    encrypt_fragment_sync((fragment_id, fragment, master_key, data_shares, total_shares))
+                )
+        return encrypted_shares
+    finally:
+        shm.close()
+
+
+def encode_shares(encoder, parts, data_shares):
+    """Split the concatenated parts into equal-size primary shares and erasure-code them into all shares."""
+    # Length prefix + parts + zero padding are written once into one buffer; shares are views into it
+    length = sum(len(part) for part in parts)
+    share_size = -(-(4 + length) // data_shares)
+    payload = bytearray(share_size * data_shares)
+    struct.pack_into(">I", payload, 0, length)
+    offset = 4
+    for part in parts:
+        payload[offset:offset + len(part)] = part
+        offset += len(part)
+    view = memoryview(payload)
+    return encoder.encode([view[i:i + share_size] for i in range(0, len(payload), share_size)])
+
+
+def decode_shares(decoder, shares, share_ids):
+    """Rebuild the original data from any data_shares shares and their share ids."""
+    payload = b"".join(decoder.decode(shares, share_ids))
+    (length,) = struct.unpack(">I", payload[:4])
+    return payload[4:4 + length]
+
+
+def compress_parts(data):
+    """Compress data with Zstandard level 1 into (tag, body); body is data itself if that saves under 2%."""
+    compressed = _COMPRESSOR.compress(data)
+    if len(compressed) >= 0.98 * len(data):
+        # Incompressible (e.g. random or already-encrypted) input
+        return _RAW_TAG, data
+    return _ZSTD_TAG, compressed
 
 
 def decompress_data(data):
-    """Decompress data using zlib."""
-    return zlib.decompress(data)
+    """Decompress the joined tag and body produced by compress_parts."""
+    tag, payload = data[:1], data[1:]
+    if tag == _RAW_TAG:
+        return payload
+    if tag == _ZSTD_TAG:
+        return _DECOMPRESSOR.decompress(payload)
+    raise ValueError(f"Unknown compression tag {tag!r}.")
+
+
+class NodeSegment:
+    """Append-only segment file holding every share stored on one node, plus its offset index."""
+    def __init__(self, node_path):
+        self.segment_path = os.path.join(node_path, "segment.bin")
+        self.index_path = os.path.join(node_path, "segment_index.pkl")
+        self.index = None  # (fragment_id, share_id) -> (offset, length), loaded lazily
+        self.lock = asyncio.Lock()
+        self._write_fd = None
+        self._read_fd = None
+        self._offset = 0
+
+    def load_index(self):
+        """Load the persisted offset index, or an empty one if the node has none."""
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "rb") as f:
+            return pickle.load(f)
+
+    def save_index(self, index):
+        """Persist the offset index alongside the segment file."""
+        with open(self.index_path, "wb") as f:
+            pickle.dump(index, f)
+
+    async def append(self, key, data):
+        """Append data to the segment and record its (offset, length) under key."""
+        length = len(data)
+        # Only the offset reservation is serialised; the pwrite below runs outside the lock
+        async with self.lock:
+            if self._write_fd is None:
+                if self.index is None:
+                    self.index = self.load_index()
+                self._write_fd = os.open(self.segment_path, os.O_WRONLY | os.O_CREAT, 0o666)
+                self._offset = os.fstat(self._write_fd).st_size
+            offset = self._offset
+            self._offset += length
+            self.index[key] = (offset, length)
+        await asyncio.get_running_loop().run_in_executor(None, _pwrite_all, self._write_fd, data, offset)
+
+    async def read(self, key):
+        """Read the bytes stored under key, or None if this node does not hold them."""
+        if self.index is None:
+            self.index = self.load_index()
+        location = self.index.get(key)
+        if location is None:
+            return None
+        if self._read_fd is None:
+            if not os.path.exists(self.segment_path):
+                return None
+            self._read_fd = os.open(self.segment_path, os.O_RDONLY)
+        offset, length = location
+        return await asyncio.get_running_loop().run_in_executor(None, os.pread, self._read_fd, length, offset)
+
+    def close(self):
+        """Persist the index if anything was written, release file descriptors and drop the cached index."""
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+            self.save_index(self.index)
+        if self._read_fd is not None:
+            os.close(self._read_fd)
+            self._read_fd = None
+        self.index = None
+
+
+def _pwrite_all(fd, data, offset):
+    """Write all of data to fd at offset with pwrite, retrying on short writes."""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        offset += written
+        view = view[written:]
 
 
 class AssemblyLine:
-    def __init__(self, node_paths, dataset_checksum, fragment_size, replication_factor=3):
+    def __init__(self, node_paths, dataset_checksum, fragment_size, data_shares=6, total_shares=9):
         self.node_paths = node_paths
-        self.kms = KeyManagementSystem(dataset_checksum)
+        self.segments = [NodeSegment(node_path) for node_path in node_paths]
+        self.kms = KeyManagementSystem(dataset_checksum, total_shares)
         self.fragment_size = fragment_size
-        self.replication_factor = replication_factor
+        # Reed-Solomon (k, n): any data_shares of the total_shares shares rebuild a fragment
+        self.data_shares = data_shares
+        self.total_shares = total_shares
+        self.encoder = _zfec_encoder(data_shares, total_shares)
+        self.decoder = zfec.Decoder(data_shares, total_shares)
+        # Share i of fragment f lives on node (f * total_shares + i) % len(node_paths). That layout
+        # repeats every len(node_paths) / gcd(total_shares, len(node_paths)) fragments, so the
+        # node segment for every share is looked up from one small precomputed table.
+        self._layout_period = len(node_paths) // math.gcd(total_shares, len(node_paths))
+        self._share_segments = [
+            [self.segments[(fragment_id * total_shares + share_id) % len(node_paths)] for share_id in range(total_shares)]
+            for fragment_id in range(self._layout_period)
+        ]
+        # Concurrency target carried between store and retrieve phases
+        self._cc_target = max(MIN_CONCURRENT_TASKS, min(MAX_CONCURRENT_TASKS, multiprocessing.cpu_count() * 2))
         # Initialize ProcessPoolExecutor for CPU-bound tasks
-        self.executor = ProcessPoolExecutor(max_workers=multiprocessing.cpu_count())
-
-    async def fragment_data(self, data, fragment_size=None):
-        """Split data into fragments."""
-        if fragment_size is None:
-            fragment_size = self.fragment_size
-        fragments = [data[i:i + fragment_size] for i in range(0, len(data), fragment_size)]
-        logging.info(f"Fragmentation complete: {len(fragments)} fragments created.")
-        return fragments
+        self.max_workers = multiprocessing.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
 
-    async def inline_process_small_dataset(self, data):
+    def fragment_count(self, data_size):
+        """Number of fragments fragment_data will yield for data_size bytes."""
+        return -(-data_size // self.fragment_size)
+
+    async def fragment_data(self, data):
+        """Yield (fragment_id, fragment) pairs as zero-copy views of at most fragment_size bytes into data."""
+        view = memoryview(data)
+        for fragment_id, i in enumerate(range(0, len(view), self.fragment_size)):
+            yield fragment_id, view[i:i + self.fragment_size]
+        logging.info(f"Fragmentation complete: {self.fragment_count(len(view))} fragments created.")
+
+    async def inline_process_small_dataset(self, data, fragment_id=0):
         """Process small datasets inline to minimize overhead."""
-        fragment_id = 0
-        compressed_data = compress_data(data)
-        encrypted_fragment, tag, checksum = self.encrypt_fragment_sync_inline(fragment_id, compressed_data, replica=0)
-        return [(fragment_id, 0, encrypted_fragment, tag, checksum)]
-
-    def encrypt_fragment_sync_inline(self, fragment_id, compressed_fragment, replica=0):
-        """Inline encryption for small datasets."""
-        key, nonce = self.kms.generate_key(fragment_id, replica)
-        cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
-        encryptor = cipher.encryptor()
-        encrypted_fragment = encryptor.update(compressed_fragment) + encryptor.finalize()
-        tag = encryptor.tag
-        checksum = calculate_checksum(encrypted_fragment)
-        return encrypted_fragment, tag, checksum
-
-    async def encrypt_fragments(self, fragments, inline=False):
-        """Encrypt fragments using AES-GCM, parallelized."""
-        if inline and len(fragments) == 1:
-            # Inline processing for small datasets
-            compressed_data = compress_data(fragments[0])
-            encrypted_fragment, tag, checksum = self.encrypt_fragment_sync_inline(0, compressed_data, replica=0)
-            return [(0, 0, encrypted_fragment, tag, checksum)]
-
-        loop = asyncio.get_event_loop()
-        # Prepare args: (fragment_id, fragment, dataset_checksum, replica)
-        # For replication, prepare multiple args per fragment
-        args = []
-        for i, fragment in enumerate(fragments):
-            compressed_fragment = compress_data(fragment)
-            for replica in range(self.replication_factor):
-                args.append((i, compressed_fragment, self.kms.dataset_checksum, replica))
-        tasks = [
-            loop.run_in_executor(self.executor, encrypt_fragment_sync, arg)
-            for arg in args
+        shares = encode_shares(self.encoder, compress_parts(data), self.data_shares)
+        fragment_keys = self.kms.generate_fragment_keys(fragment_id)
+        return [
+            (fragment_id, share_id, self.encrypt_fragment_sync_inline(share, key, nonce))
+            for share_id, (share, (key, nonce)) in enumerate(zip(shares, fragment_keys))
         ]
-        encrypted_fragments = await asyncio.gather(*tasks)
-        logging.info("Encryption complete.")
-        return encrypted_fragments
-
-    async def store_fragments(self, encrypted_fragments, max_concurrent_tasks=100):
-        """Store encrypted fragments asynchronously with batching."""
-        semaphore = asyncio.Semaphore(max_concurrent_tasks)
-        # Adjust batch size based on total fragments
-        total_fragments = len(encrypted_fragments) // self.replication_factor
-        if total_fragments > 1000:
-            batch_size = 50
-        elif total_fragments > 500:
-            batch_size = 25
-        else:
-            batch_size = 10
-
-        async def store_batch(batch):
-            tasks = [
-                self._store_fragment(fragment_id, replica, encrypted_fragment, tag, checksum)
-                for fragment_id, replica, encrypted_fragment, tag, checksum in batch
-            ]
-            await asyncio.gather(*tasks)
 
-        for i in range(0, len(encrypted_fragments), batch_size * self.replication_factor):
-            batch = encrypted_fragments[i:i + batch_size * self.replication_factor]
-            async with semaphore:
-                await store_batch(batch)
-        logging.info("All fragments stored.")
-
-    async def _store_fragment(self, fragment_id, replica, encrypted_fragment, tag, checksum):
-        node_index = (fragment_id * self.replication_factor + replica) % len(self.node_paths)
-        node_path = self.node_paths[node_index]
-        fragment_path = os.path.join(node_path, f"fragment_{fragment_id}_replica_{replica}.pkl")
-        async with aiofiles.open(fragment_path, "wb") as f:
-            # Store encrypted_fragment + tag + checksum
-            await f.write(encrypted_fragment + tag + checksum)
-        logging.debug(f"Fragment {fragment_id} replica {replica} stored at {fragment_path}.")
-
-    async def retrieve_fragments(self, num_fragments, max_concurrent_tasks=100):
-        """Retrieve and decrypt fragments asynchronously with replication."""
-        semaphore = asyncio.Semaphore(max_concurrent_tasks)
-        # Adjust batch size based on total fragments
-        if num_fragments > 1000:
-            batch_size = 50
-        elif num_fragments > 500:
-            batch_size = 25
-        else:
-            batch_size = 10
-
-        # For each fragment, list of replicas
-        fragment_replicas = {}
-        for fragment_id in range(num_fragments):
-            replicas = list(range(self.replication_factor))
-            fragment_replicas[fragment_id] = replicas
+    def encrypt_fragment_sync_inline(self, share, key, nonce):
+        """Inline encryption for small datasets; returns ciphertext + 16-byte GCM tag."""
+        return AESGCM(key).encrypt(nonce, share, None)
 
-        # Define retrieval tasks per fragment
-        async def retrieve_fragment(fragment_id):
-            replicas = fragment_replicas[fragment_id]
-            for replica in replicas:
-                node_index = (fragment_id * self.replication_factor + replica) % len(self.node_paths)
-                node_path = self.node_paths[node_index]
-                fragment_path = os.path.join(node_path, f"fragment_{fragment_id}_replica_{replica}.pkl")
-
-                if not os.path.exists(fragment_path):
-                    logging.warning(f"Fragment {fragment_id} replica {replica} is missing.")
+    async def encrypt_fragments(self, fragments, inline=False, num_fragments=None):
+        """Compress, erasure-code and encrypt fragments, yielding encrypted shares as they complete."""
+        if inline:
+            # Inline processing for small datasets
+            async for fragment_id, fragment in fragments:
+                for encrypted_share in await self.inline_process_small_dataset(fragment, fragment_id):
+                    yield encrypted_share
+            logging.info("Encryption complete.")
+            return
+
+        loop = asyncio.get_running_loop()
+        fragment_queue = asyncio.Queue(maxsize=self.max_workers)
+        share_queue = asyncio.Queue(maxsize=self.max_workers)
+        fragments_per_task = FRAGMENTS_PER_TASK
+        if num_fragments is not None:
+            # Same rule as Executor.map chunksize: about four tasks per worker, capped per task
+            fragments_per_task = max(1, min(FRAGMENTS_PER_TASK, num_fragments // (self.max_workers * 4)))
+        # One shared memory region per consumer, so peak memory is bounded by the worker count
+        region_size = fragments_per_task * self.fragment_size
+        shm = SharedMemory(create=True, size=self.max_workers * region_size)
+
+        # Tasks report errors to the main loop through share_queue, and never put a sentinel
+        # when cancelled, so teardown cannot block on a queue nobody drains
+        async def produce():
+            try:
+                async for fragment_id, fragment in fragments:
+                    await fragment_queue.put((fragment_id, fragment))
+            except Exception as e:
+                await share_queue.put(e)
+                return
+            for _ in range(self.max_workers):
+                await fragment_queue.put(None)
+
+        async def consume(region_offset):
+            try:
+                done = False
+                while not done:
+                    batch = []
+                    offset = region_offset
+                    while len(batch) < fragments_per_task:
+                        item = await fragment_queue.get()
+                        if item is None:
+                            done = True
+                            break
+                        fragment_id, fragment = item
+                        if len(fragment) > self.fragment_size:
+                            raise ValueError(
+                                f"Fragment {fragment_id} is larger than the fragment size {self.fragment_size}."
+                            )
+                        shm.buf[offset:offset + len(fragment)] = fragment
+                        batch.append((fragment_id, offset, len(fragment)))
+                        offset += len(fragment)
+                    if batch:
+                        # Args: (shm_name, [(fragment_id, offset, length)], master_key, data_shares, total_shares)
+                        args = (shm.name, batch, self.kms.master_key, self.data_shares, self.total_shares)
+                        await share_queue.put(await loop.run_in_executor(self.executor, encrypt_fragment_batch_sync, args))
+            except Exception as e:
+                await share_queue.put(e)
+                return
+            await share_queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        consumers = [asyncio.create_task(consume(i * region_size)) for i in range(self.max_workers)]
+        try:
+            finished = 0
+            while finished < len(consumers):
+                encrypted_shares = await share_queue.get()
+                if encrypted_shares is None:
+                    finished += 1
                     continue
+                if isinstance(encrypted_shares, Exception):
+                    raise encrypted_shares
+                for encrypted_share in encrypted_shares:
+                    yield encrypted_share
+        finally:
+            for task in (producer, *consumers):
+                task.cancel()
+            await asyncio.gather(producer, *consumers, return_exceptions=True)
+            shm.close()
+            shm.unlink()
+        logging.info("Encryption complete.")
 
-                async with aiofiles.open(fragment_path, "rb") as f:
-                    data = await f.read()
+    async def store_fragments(self, encrypted_fragments, max_concurrent_tasks=None):
+        """Store encrypted shares from an async iterable with adaptive concurrency."""
+        controller = AdaptiveConcurrency(max_concurrent_tasks or self._cc_target)
+        tasks = set()
+        errors = []
+
+        async def store_share(encrypted_share, started):
+            try:
+                await self._store_fragment(*encrypted_share)
+            finally:
+                await controller.release(started)
+
+        def task_done(task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                errors.append(task.exception())
+
+        try:
+            # Close the share stream on error too, so its tasks and shared memory are released
+            async with contextlib.aclosing(encrypted_fragments) as encrypted_shares:
+                async for encrypted_share in encrypted_shares:
+                    if errors:
+                        raise errors[0]
+                    started = await controller.acquire()
+                    task = asyncio.create_task(store_share(encrypted_share, started))
+                    tasks.add(task)
+                    task.add_done_callback(task_done)
+            await asyncio.gather(*tasks)
+            if errors:
+                raise errors[0]
+        finally:
+            # Let in-flight writes finish before their segment descriptors are closed
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Persist each node's offset index once, after all shares are written
+            for segment in self.segments:
+                segment.close()
+            self._cc_target = controller.limit
+        logging.info(f"All fragments stored (final concurrency {controller.limit}).")
+
+    async def _store_fragment(self, fragment_id, share_id, encrypted_share):
+        segment = self._share_segments[fragment_id % self._layout_period][share_id]
+        # Store the AEAD output (ciphertext + tag) as-is; the GCM tag authenticates the ciphertext
+        await segment.append((fragment_id, share_id), encrypted_share)
+        logging.debug(f"Fragment {fragment_id} share {share_id} stored in {segment.segment_path}.")
+
+    async def retrieve_fragments(self, num_fragments, max_concurrent_tasks=None):
+        """Retrieve, decrypt and erasure-decode fragments with adaptive concurrency."""
+        controller = AdaptiveConcurrency(max_concurrent_tasks or self._cc_target)
 
-                if len(data) < 48:  # encrypted_fragment + tag + checksum
-                    logging.error(f"Fragment {fragment_id} replica {replica} data is incomplete or corrupted.")
+        # Define retrieval tasks per fragment
+        async def retrieve_fragment(fragment_id):
+            # Primary shares come first, so an intact fragment decodes without parity work
+            shares, share_ids = [], []
+            fragment_keys = self.kms.generate_fragment_keys(fragment_id)
+            share_segments = self._share_segments[fragment_id % self._layout_period]
+            for share_id, segment in enumerate(share_segments):
+                data = await segment.read((fragment_id, share_id))
+
+                if data is None:
+                    logging.warning(f"Fragment {fragment_id} share {share_id} is missing.")
                     continue
 
-                encrypted_fragment = data[:-48]
-                tag = data[-48:-32]
-                checksum = data[-32:]
-
-                # Verify checksum
-                calculated_checksum = calculate_checksum(encrypted_fragment)
-                if checksum != calculated_checksum:
-                    logging.error(f"Checksum mismatch for fragment {fragment_id} replica {replica}.")
+                if len(data) < 16:  # ciphertext + tag
+                    logging.error(f"Fragment {fragment_id} share {share_id} data is incomplete or corrupted.")
                     continue
 
-                # Decrypt
-                key, nonce = self.kms.generate_key(fragment_id, replica)
-                cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
-                decryptor = cipher.decryptor()
-
+                # Decrypt; data is already ciphertext + tag, and any modification fails the tag check
+                key, nonce = fragment_keys[share_id]
                 try:
-                    decrypted_compressed_fragment = decryptor.update(encrypted_fragment) + decryptor.finalize()
-                    decrypted_fragment = decompress_data(decrypted_compressed_fragment)
-                    logging.debug(f"Fragment {fragment_id} replica {replica}: Decrypted and decompressed data.")
-                    return decrypted_fragment
-                except Exception as e:
-                    logging.error(f"Decryption failed for fragment {fragment_id} replica {replica}: {e}")
+                    share = AESGCM(key).decrypt(nonce, data, None)
+                except InvalidTag:
+                    logging.error(f"Authentication failed for fragment {fragment_id} share {share_id}.")
                     continue
 
-            # If all replicas failed
-            logging.error(f"All replicas failed for fragment {fragment_id}.")
-            return None
-
-        # Batch retrieval
-        fragments = []
-        for i in range(0, num_fragments, batch_size):
-            batch_ids = range(i, min(i + batch_size, num_fragments))
-            async with semaphore:
-                retrieved = await asyncio.gather(*[retrieve_fragment(fid) for fid in batch_ids])
-                for fid, frag in zip(batch_ids, retrieved):
-                    if frag is not None:
-                        fragments.append((fid, frag))
-        fragments = [f for f in fragments if f is not None]
+                shares.append(share)
+                share_ids.append(share_id)
+                if len(shares) == self.data_shares:
+                    break
+            else:
+                # Fewer than data_shares shares survived
+                logging.error(f"Not enough shares to rebuild fragment {fragment_id}.")
+                return None
+
+            try:
+                decrypted_fragment = decompress_data(decode_shares(self.decoder, shares, share_ids))
+                logging.debug(f"Fragment {fragment_id}: Decoded and decompressed data from shares {share_ids}.")
+                return decrypted_fragment
+            except Exception as e:
+                logging.error(f"Decoding failed for fragment {fragment_id}: {e}")
+                return None
+
+        async def retrieve_with_limit(fragment_id):
+            started = await controller.acquire()
+            try:
+                return await retrieve_fragment(fragment_id)
+            finally:
+                await controller.release(started)
+
+        tasks = [asyncio.create_task(retrieve_with_limit(fid)) for fid in range(num_fragments)]
+        try:
+            retrieved = await asyncio.gather(*tasks)
+        finally:
+            # Let in-flight reads finish before their segment descriptors are closed
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for segment in self.segments:
+                segment.close()
+            self._cc_target = controller.limit
+        fragments = [(fid, frag) for fid, frag in enumerate(retrieved) if frag is not None]
         logging.info(f"Retrieved {len(fragments)}/{num_fragments} fragments.")
         return fragments
 